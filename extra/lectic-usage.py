@@ -3,16 +3,41 @@
 from __future__ import annotations
 
 import argparse
-import collections
 import difflib
+import functools
 import json
 import os
 import re
 import sys
-from dataclasses import dataclass
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+try:
+    # Optional: streams large usage files instead of materializing them.
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    # Optional: serializes in C, which matters because the hook rewrites
+    # the whole usage file synchronously on every assistant turn.
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    # Optional: vectorizes bucket accumulation on long hourly histories.
+    import numpy as np
+except ImportError:
+    np = None
+
+
+_NORM_RE = re.compile(r"[^a-z0-9]+")
+
+
+def _normalize(s: str) -> str:
+    return _NORM_RE.sub("-", s.lower()).strip("-")
 
 
 COLORS = [
@@ -41,6 +66,17 @@ def _usage_path() -> Path:
     return Path(data) / "usage.json"
 
 
+def _wal_path() -> Path:
+    data = os.environ.get("LECTIC_DATA")
+    if not data:
+        raise RuntimeError(
+            "LECTIC_DATA is not set. Run via 'lectic usage' or set "
+            "LECTIC_DATA explicitly."
+        )
+
+    return Path(data) / "usage.wal"
+
+
 def _prices_path() -> Path:
     data = os.environ.get("LECTIC_DATA")
     if not data:
@@ -67,7 +103,9 @@ def _load_json(path: Path) -> Dict[str, Any]:
     if not path.exists():
         return {}
 
-    data = json.loads(path.read_text(encoding="utf-8"))
+    # json.loads accepts UTF-8 bytes directly; decoding to str first
+    # would make a second full-size copy of the file.
+    data = json.loads(path.read_bytes())
     if not isinstance(data, dict):
         raise ValueError(f"usage file must be a JSON object: {path}")
 
@@ -78,38 +116,179 @@ def _atomic_write_json(path: Path, data: Dict[str, Any]) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
 
     tmp = path.with_suffix(path.suffix + ".tmp")
-    payload = json.dumps(data, indent=2, sort_keys=True)
-    tmp.write_text(payload + "\n", encoding="utf-8")
+    if orjson is not None:
+        payload = orjson.dumps(
+            data, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS
+        )
+        tmp.write_bytes(payload + b"\n")
+    else:
+        payload = json.dumps(data, indent=2, sort_keys=True)
+        tmp.write_text(payload + "\n", encoding="utf-8")
     os.replace(tmp, path)
 
 
-@dataclass
 class Tokens:
-    input: int
-    output: int
-    cached: int
+    # Slotted rather than a dataclass so instances stay compact and
+    # attribute lookups skip the instance dict. Note that cached tokens
+    # are a subset of input, so a grand total is input + output.
+    __slots__ = ("input", "output", "cached")
 
-    @property
-    def total(self) -> int:
-        # cached tokens are a subset of input
-        return self.input + self.output
+    def __init__(self, input: int, output: int, cached: int) -> None:
+        self.input = input
+        self.output = output
+        self.cached = cached
 
 
-def _bump_model(models: Dict[str, Any], model: str, inc: Tokens) -> None:
-    entry: Dict[str, Any]
+def _validate_usage_db(db: Dict[str, Any], path: Path) -> None:
+    """
+    Check and normalize the mutable subtrees once after load, so the
+    bump helpers can skip per-call shape checks. Non-dict hour and model
+    entries are replaced with empty ones, the same way the bumps used to
+    heal them; structurally wrong tables raise, as before.
+    """
+    hourly = db.setdefault("hourly", {})
+    if not isinstance(hourly, dict):
+        raise ValueError(f"usage file has non-object 'hourly': {path}")
+
+    for hour, entry in hourly.items():
+        if not isinstance(entry, dict):
+            entry = hourly[hour] = {}
 
-    raw = models.get(model)
-    if isinstance(raw, dict):
-        entry = raw
-    else:
-        entry = {}
-        models[model] = entry
+        models = entry.setdefault("models", {})
+        if not isinstance(models, dict):
+            raise ValueError("hourly entry has non-object 'models'")
+
+        for model, usage in models.items():
+            if not isinstance(usage, dict):
+                models[model] = {}
+
+    for field, _ in _ROLLUPS:
+        rollup = db.get(field)
+        if rollup is None:
+            continue
+        if not isinstance(rollup, dict):
+            raise ValueError(f"usage file has non-object '{field}': {path}")
+
+        for key, models in rollup.items():
+            if not isinstance(models, dict):
+                raise ValueError(f"'{field}' entry is not an object")
+
+            for model, usage in models.items():
+                if not isinstance(usage, dict):
+                    models[model] = {}
+
+
+def _bump_model(
+    models: Dict[str, Any],
+    model: str,
+    inc: Tokens,
+    now_iso: str,
+    turns: int = 1,
+) -> None:
+    # Entries are guaranteed to be dicts: either created here or checked
+    # up front by _validate_usage_db.
+    entry = models.get(model)
+    if entry is None:
+        entry = models[model] = {}
 
     entry["input_tokens"] = int(entry.get("input_tokens", 0)) + inc.input
     entry["output_tokens"] = int(entry.get("output_tokens", 0)) + inc.output
     entry["cached_tokens"] = int(entry.get("cached_tokens", 0)) + inc.cached
-    entry["turns"] = int(entry.get("turns", 0)) + 1
-    entry["updated_at"] = _now_iso_utc()
+    entry["turns"] = int(entry.get("turns", 0)) + turns
+    entry["updated_at"] = now_iso
+
+
+def _get_bucket_key(dt: datetime, granularity: str) -> str:
+    if granularity == "hour":
+        return dt.strftime("%Y-%m-%d %H:00")
+    elif granularity == "day":
+        return dt.strftime("%Y-%m-%d")
+    elif granularity == "week":
+        # ISO week date
+        year, week, _ = dt.isocalendar()
+        return f"{year}-W{week:02d}"
+    elif granularity == "month":
+        return dt.strftime("%Y-%m")
+    return str(dt)
+
+
+# Roll-up tables maintained at write time so day/week/month graphs don't
+# have to re-bucket the whole hourly history on every render. Each maps
+# bucket key -> models dict, in the same shape _bump_model maintains.
+_ROLLUPS = (("daily", "day"), ("weekly", "week"), ("monthly", "month"))
+
+_ROLLUP_FIELDS = {gran: field for field, gran in _ROLLUPS}
+
+
+def _bump_rollups(
+    db: Dict[str, Any],
+    ts: datetime,
+    model: str,
+    inc: Tokens,
+    now_iso: str,
+    turns: int = 1,
+) -> None:
+    for field, granularity in _ROLLUPS:
+        rollup = db.setdefault(field, {})
+        models = rollup.setdefault(_get_bucket_key(ts, granularity), {})
+        _bump_model(models, model, inc, now_iso, turns=turns)
+
+
+def _backfill_rollups(db: Dict[str, Any]) -> None:
+    """
+    Rebuild the roll-up tables from the hourly table. Used once to
+    upgrade databases written before roll-ups existed, and by
+    --rebuild-rollups to repair them.
+    """
+    for field, _ in _ROLLUPS:
+        db[field] = {}
+
+    hourly = db.get("hourly", {})
+    if not isinstance(hourly, dict):
+        return
+
+    now_iso = _now_iso_utc()
+
+    for hour, entry in hourly.items():
+        if not isinstance(entry, dict):
+            continue
+
+        try:
+            dt = datetime.fromisoformat(hour)
+        except ValueError:
+            continue
+
+        models = entry.get("models", {})
+        if not isinstance(models, dict):
+            continue
+
+        for model, usage in models.items():
+            if not isinstance(usage, dict):
+                continue
+
+            inc = Tokens(
+                input=int(usage.get("input_tokens", 0)),
+                output=int(usage.get("output_tokens", 0)),
+                cached=int(usage.get("cached_tokens", 0)),
+            )
+            _bump_rollups(
+                db, dt, model, inc, now_iso, turns=int(usage.get("turns", 0))
+            )
+
+
+def _rebuild_rollups() -> int:
+    _compact_wal()
+
+    path = _usage_path()
+    db = _load_json(path)
+
+    _validate_usage_db(db, path)
+    _backfill_rollups(db)
+
+    db["updated_at"] = _now_iso_utc()
+    _atomic_write_json(path, db)
+    print(f"Roll-ups rebuilt in {path}")
+    return 0
 
 
 def _hour_bucket_iso(ts: Optional[datetime] = None) -> str:
@@ -125,46 +304,128 @@ def _bump_hour(
     hour: str,
     model: str,
     inc: Tokens,
+    now_iso: str,
 ) -> None:
-    raw = hourly.get(hour)
-    if isinstance(raw, dict):
-        hour_entry = raw
-    else:
-        hour_entry = {}
-        hourly[hour] = hour_entry
+    hour_entry = hourly.get(hour)
+    if hour_entry is None:
+        hour_entry = hourly[hour] = {}
 
-    models_raw = hour_entry.setdefault("models", {})
-    if not isinstance(models_raw, dict):
-        raise ValueError("hourly entry has non-object 'models'")
-
-    _bump_model(models_raw, model, inc)
-    hour_entry["updated_at"] = _now_iso_utc()
+    _bump_model(hour_entry.setdefault("models", {}), model, inc, now_iso)
+    hour_entry["updated_at"] = now_iso
 
 
 def _record_hook_usage() -> int:
     model = os.environ.get("LECTIC_MODEL") or "unknown"
 
-    inc = Tokens(
-        input=_parse_int_env("TOKEN_USAGE_INPUT"),
-        output=_parse_int_env("TOKEN_USAGE_OUTPUT"),
-        cached=_parse_int_env("TOKEN_USAGE_CACHED"),
-    )
+    # The hook runs synchronously on every assistant turn, so it must not
+    # pay for the size of the accumulated history. Append one line to a
+    # write-ahead log instead of rewriting usage.json; readers fold the
+    # log in via _compact_wal before rendering.
+    record = {
+        "hour": _hour_bucket_iso(),
+        "model": model,
+        "input": _parse_int_env("TOKEN_USAGE_INPUT"),
+        "output": _parse_int_env("TOKEN_USAGE_OUTPUT"),
+        "cached": _parse_int_env("TOKEN_USAGE_CACHED"),
+    }
 
-    path = _usage_path()
+    path = _wal_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a", encoding="utf-8") as f:
+        # A single write of one short line: O_APPEND keeps concurrent
+        # hooks from interleaving.
+        f.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    return 0
+
+
+def _compact_wal() -> None:
+    """
+    Fold pending write-ahead-log records into usage.json and remove the
+    log. The log is renamed aside before folding, so hooks that append
+    mid-compaction start a fresh log instead of having their records
+    deleted unapplied, and two concurrent renders can't double-apply the
+    same batch.
+    """
+    wal = _wal_path()
+    pending = wal.with_suffix(".compacting")
+
+    # Fold any log left aside by a crashed compaction before claiming
+    # the current one, so the rename below never clobbers records.
+    if pending.exists():
+        _fold_wal(pending)
+
+    if not wal.exists():
+        return
+
+    try:
+        os.replace(wal, pending)
+    except FileNotFoundError:
+        # Another process claimed the log between the check and the
+        # rename; its compaction will fold these records.
+        return
+
+    _fold_wal(pending)
 
+
+def _fold_wal(pending: Path) -> None:
+    """
+    Apply the records in a claimed log file to usage.json, then remove
+    it. Malformed lines are skipped rather than wedging the graph.
+    """
+    path = _usage_path()
     db = _load_json(path)
 
-    hourly_raw = db.setdefault("hourly", {})
-    if not isinstance(hourly_raw, dict):
-        raise ValueError(f"usage file has non-object 'hourly': {path}")
+    # Shape checks happen once here instead of inside every bump.
+    _validate_usage_db(db, path)
+    hourly_raw = db["hourly"]
 
-    hour = _hour_bucket_iso()
-    _bump_hour(hourly_raw, hour, model, inc)
+    # One-time upgrade for databases written before roll-ups existed:
+    # backfill so day/week/month graphs can trust the roll-up tables.
+    if any(field not in db for field, _ in _ROLLUPS):
+        _backfill_rollups(db)
 
-    db["updated_at"] = _now_iso_utc()
-    _atomic_write_json(path, db)
+    # One timestamp for the whole pass; per-record _now_iso_utc calls
+    # would just allocate near-identical datetimes.
+    now_iso = _now_iso_utc()
 
-    return 0
+    applied = False
+    for line in pending.read_text(encoding="utf-8").splitlines():
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if not isinstance(record, dict):
+            continue
+
+        hour = record.get("hour")
+        model = record.get("model")
+        if not isinstance(hour, str) or not isinstance(model, str):
+            continue
+
+        try:
+            ts = datetime.fromisoformat(hour)
+        except ValueError:
+            continue
+
+        inc = Tokens(
+            input=int(record.get("input", 0)),
+            output=int(record.get("output", 0)),
+            cached=int(record.get("cached", 0)),
+        )
+        _bump_hour(hourly_raw, hour, model, inc, now_iso)
+        _bump_rollups(db, ts, model, inc, now_iso)
+        applied = True
+
+    if applied:
+        db["updated_at"] = now_iso
+        _atomic_write_json(path, db)
+
+    pending.unlink()
 
 
 GENAI_PRICES_URL = (
@@ -340,10 +601,18 @@ def _fmt_money(amount: float) -> str:
     return f"${amount:,.2f}"
 
 
-def _find_price(price_map: Dict[str, Any], model: str) -> Optional[Dict[str, float]]:
+def _find_price(
+    price_map: Dict[str, Any],
+    norm_keys: Dict[str, str],
+    norm_items_by_len: List[Tuple[str, str]],
+    model: str,
+) -> Optional[Dict[str, float]]:
     """
     Find the price for a model, using exact match, normalized match,
-    longest prefix match, or fuzzy matching.
+    longest prefix match, or fuzzy matching. `norm_keys` maps each
+    normalized price-map key back to its original key; `norm_items_by_len`
+    holds the same pairs sorted by descending key length. Both are
+    precomputed once per price map by the caller.
     """
     if not price_map:
         return None
@@ -351,28 +620,24 @@ def _find_price(price_map: Dict[str, Any], model: str) -> Optional[Dict[str, flo
     if model in price_map:
         return price_map[model]
 
-    def normalize(s: str) -> str:
-        return re.sub(r"[^a-z0-9]+", "-", s.lower()).strip("-")
-
-    norm_model = normalize(model)
-    norm_keys = {normalize(k): k for k in price_map}
+    norm_model = _normalize(model)
 
     # 1. Exact normalized match
     if norm_model in norm_keys:
         return price_map[norm_keys[norm_model]]
 
-    # 2. Longest prefix match on normalized names
-    best_match = None
-    best_len = -1
-    for norm_p_id, orig_p_id in norm_keys.items():
-        if norm_model.startswith(norm_p_id) and len(norm_p_id) > best_len:
-            best_match = orig_p_id
-            best_len = len(norm_p_id)
+    # 2. Longest prefix match on normalized names; keys are sorted by
+    # descending length, so the first hit is the longest.
+    for norm_p_id, orig_p_id in norm_items_by_len:
+        if norm_model.startswith(norm_p_id):
+            return price_map[orig_p_id]
 
-    if best_match:
-        return price_map[best_match]
+    # 3. Fuzzy matching as a last resort. SequenceMatcher runs a ratio
+    # against every key and is quadratic in string length, so databases
+    # full of unknown models can turn it off with LECTIC_FUZZY_PRICES=0.
+    if os.environ.get("LECTIC_FUZZY_PRICES", "1").lower() in ("0", "false", "no"):
+        return None
 
-    # 3. Fuzzy matching as a last resort
     close_matches = difflib.get_close_matches(
         norm_model, norm_keys.keys(), n=1, cutoff=0.6
     )
@@ -382,150 +647,400 @@ def _find_price(price_map: Dict[str, Any], model: str) -> Optional[Dict[str, flo
     return None
 
 
+def _iter_table(path: Path, field: str) -> Iterator[Tuple[str, Any]]:
+    """
+    Yield (key, entry) pairs from a top-level table of the usage file
+    ('hourly' or one of the roll-ups). With ijson installed the file is
+    streamed one entry at a time, so peak memory stays independent of
+    history length; otherwise the whole file is parsed up front.
+    """
+    if not path.exists():
+        return
+
+    if ijson is not None:
+        with path.open("rb") as f:
+            yield from ijson.kvitems(f, field)
+        return
+
+    table = _load_json(path).get(field, {})
+    if isinstance(table, dict):
+        yield from table.items()
+
+
+# Matches the fixed "YYYY-MM-DDTHH:" layout of hour keys the hook writes.
+_ISO_HOUR_PREFIX_RE = re.compile(r"\d{4}-\d{2}-\d{2}T\d{2}:")
+
+
+def _bucket_key_from_iso(time_str: str, granularity: str) -> Optional[str]:
+    """
+    Compute a bucket key by slicing an ISO-8601 hour key, avoiding the
+    datetime round-trip in the hourly scan. Returns None when the key
+    doesn't have the layout the hook writes, or when the granularity
+    needs real calendar math (ISO weeks).
+    """
+    if not _ISO_HOUR_PREFIX_RE.match(time_str):
+        return None
+
+    if granularity == "hour":
+        return f"{time_str[:10]} {time_str[11:13]}:00"
+    if granularity == "day":
+        return time_str[:10]
+    if granularity == "month":
+        return time_str[:7]
+    return None
+
+
+# Used to turn a unit count into a date cutoff; a month is over-estimated
+# so boundary buckets are never dropped.
+_GRANULARITY_DELTAS = {
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+    "week": timedelta(weeks=1),
+    "month": timedelta(days=31),
+}
+
+
+# Maps prices.json path -> ((mtime_ns, size), price_map, norm_keys,
+# norm_items_by_len). The file is static between --refresh-prices runs,
+# so repeated renders in one process can reuse the parsed structures.
+_PRICES_CACHE: Dict[Path, Tuple[Any, ...]] = {}
+
+
+def _load_prices(
+    path: Path,
+) -> Tuple[Dict[str, Dict[str, float]], Dict[str, str], List[Tuple[str, str]]]:
+    """
+    Parse prices.json into a price map plus the normalized-key lookup
+    structures _find_price uses, memoized on the file's (mtime, size).
+    """
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _PRICES_CACHE.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1], cached[2], cached[3]
+
+    price_map: Dict[str, Dict[str, float]] = {}
+    prices_data = _load_json(path)
+    for item in prices_data.get("prices", []):
+        p_id = item.get("id")
+        if not p_id:
+            continue
+        price_map[p_id] = {
+            "input": float(item.get("input", 0) or 0),
+            "output": float(item.get("output", 0) or 0),
+            "input_cached": float(
+                item.get("input_cached")
+                if item.get("input_cached") is not None
+                else item.get("input", 0) or 0
+            ),
+        }
+
+    norm_keys = {_normalize(k): k for k in price_map}
+    norm_items_by_len = sorted(norm_keys.items(), key=lambda kv: -len(kv[0]))
+
+    _PRICES_CACHE[path] = (stamp, price_map, norm_keys, norm_items_by_len)
+    return price_map, norm_keys, norm_items_by_len
+
+
 def _get_color(index: int) -> str:
     return COLORS[index % len(COLORS)]
 
 
-def _get_bucket_key(dt: datetime, granularity: str) -> str:
-    if granularity == "hour":
-        return dt.strftime("%Y-%m-%d %H:00")
-    elif granularity == "day":
-        return dt.strftime("%Y-%m-%d")
-    elif granularity == "week":
-        # ISO week date
-        year, week, _ = dt.isocalendar()
-        return f"{year}-W{week:02d}"
-    elif granularity == "month":
-        return dt.strftime("%Y-%m")
-    return str(dt)
+@functools.lru_cache(maxsize=4096)
+def _segment(out_len: int, inp_len: int, cached_len: int) -> str:
+    # Bars are at most 40 cells wide, so the same few length triples
+    # repeat across rows; memoize the glyph runs rather than rebuilding
+    # them per segment.
+    return "█" * out_len + "▓" * inp_len + "░" * cached_len
 
 
 def _print_graph(
-    db: Dict[str, Any],
+    path: Path,
     granularity: str,
     units: int,
     model_filter: Optional[str] = None,
     show_price: bool = False,
 ) -> int:
-    hourly = db.get("hourly", {})
-    if not isinstance(hourly, dict) or not hourly:
-        print("No usage recorded.")
-        return 0
+    # Both hour keys (ISO-8601 UTC) and bucket keys sort chronologically
+    # as strings, so out-of-range entries can be skipped before any
+    # bucketing work. One extra unit of slack keeps boundary buckets
+    # intact.
+    cutoff_dt = None
+    if units > 0:
+        delta = _GRANULARITY_DELTAS.get(granularity)
+        if delta is not None:
+            cutoff_dt = (datetime.now(timezone.utc) - delta * (units + 1)).replace(
+                minute=0, second=0, microsecond=0
+            )
 
-    filter_re = None
+    filter_search = None
     if model_filter:
         try:
-            filter_re = re.compile(model_filter)
+            filter_search = re.compile(model_filter).search
         except re.error as exc:
             raise ValueError(f"Invalid filter regex: {exc}") from exc
 
     price_map: Dict[str, Dict[str, float]] = {}
+    norm_keys: Dict[str, str] = {}
+    norm_items_by_len: List[Tuple[str, str]] = []
     if show_price:
-        path = _prices_path()
-        if not path.exists():
+        prices_file = _prices_path()
+        if not prices_file.exists():
             print(
                 "Warning: prices.json not found. Run with --refresh-prices "
                 "to download it.",
                 file=sys.stderr,
             )
         else:
-            prices_data = _load_json(path)
-            for item in prices_data.get("prices", []):
-                p_id = item.get("id")
-                if not p_id:
+            price_map, norm_keys, norm_items_by_len = _load_prices(prices_file)
+
+    # The same model name repeats across thousands of hourly buckets, so
+    # cache lookups (hits and misses alike) per unique model string. The
+    # $/Mtok rates are converted here to integer picodollars per token
+    # (scale 1e6), so cost accumulation and bar math stay in exact
+    # integer arithmetic.
+    @functools.lru_cache(maxsize=None)
+    def find_price(model: str) -> Optional[Tuple[int, int, int]]:
+        p = _find_price(price_map, norm_keys, norm_items_by_len, model)
+        if p is None:
+            return None
+        return (
+            round(p["input"] * 1_000_000),
+            round(p["input_cached"] * 1_000_000),
+            round(p["output"] * 1_000_000),
+        )
+
+    # Flat dicts keyed by (bucket, model): one hash per access instead of
+    # two nested defaultdict lookups plus a factory call per first touch.
+    # Bucket rows are [input, output, cached] token triples; costs are in
+    # integer picodollars (1e-12 USD).
+    buckets: Dict[Tuple[str, str], List[int]] = {}
+    costs: Dict[Tuple[str, str], int] = {}
+    sub_costs: Dict[Tuple[str, str], List[int]] = {}
+
+    # Which models actually appear in each bucket, for rendering.
+    key_models: Dict[str, Set[str]] = {}
+
+    def add_bucket(key: str, models: Dict[str, Any]) -> None:
+        # Bucket keys and model names recur across thousands of records;
+        # interning keeps one canonical string per unique value and lets
+        # the dict lookups below hit the pointer-equality fast path.
+        key = sys.intern(key)
+        for model, usage in models.items():
+            if not isinstance(usage, dict):
+                continue
+
+            if filter_search and not filter_search(model):
+                continue
+
+            model = sys.intern(model)
+
+            # Plain locals here: building a Tokens just to copy its fields
+            # out again would cost an allocation per record.
+            inp = int(usage.get("input_tokens", 0))
+            out = int(usage.get("output_tokens", 0))
+            cached = int(usage.get("cached_tokens", 0))
+
+            bk = (key, model)
+            row = buckets.get(bk)
+            if row is None:
+                row = buckets[bk] = [0, 0, 0]
+            row[0] += inp
+            row[1] += out
+            row[2] += cached
+
+            bucket_set = key_models.get(key)
+            if bucket_set is None:
+                bucket_set = key_models[key] = set()
+            bucket_set.add(model)
+
+    seen_any = False
+    used_rollup = False
+
+    # Day/week/month renders read the matching roll-up table directly.
+    # Only hourly renders — and databases written before roll-ups
+    # existed — re-bucket the hourly history.
+    rollup_field = _ROLLUP_FIELDS.get(granularity)
+    if rollup_field is not None:
+        cutoff_key = _get_bucket_key(cutoff_dt, granularity) if cutoff_dt else ""
+        for key, models in _iter_table(path, rollup_field):
+            used_rollup = True
+            seen_any = True
+            if cutoff_key and key < cutoff_key:
+                continue
+            if isinstance(models, dict):
+                add_bucket(key, models)
+
+    if not used_rollup and np is not None:
+        # Vectorized hourly scan: collect (bucket id, model id, tokens)
+        # rows during the walk and let np.bincount do the accumulation
+        # in C. The walk itself mirrors the scalar path below.
+        bucket_ids: Dict[str, int] = {}
+        model_ids: Dict[str, int] = {}
+        bucket_names: List[str] = []
+        model_names: List[str] = []
+        row_b: List[int] = []
+        row_m: List[int] = []
+        row_in: List[int] = []
+        row_out: List[int] = []
+        row_cached: List[int] = []
+
+        cutoff = cutoff_dt.isoformat() if cutoff_dt else ""
+        for time_str, data in _iter_table(path, "hourly"):
+            seen_any = True
+            if cutoff and time_str < cutoff:
+                continue
+            if not isinstance(data, dict):
+                continue
+
+            key = _bucket_key_from_iso(time_str, granularity)
+            if key is None:
+                try:
+                    dt = datetime.fromisoformat(time_str)
+                except ValueError:
                     continue
-                price_map[p_id] = {
-                    "input": float(item.get("input", 0) or 0),
-                    "output": float(item.get("output", 0) or 0),
-                    "input_cached": float(
-                        item.get("input_cached")
-                        if item.get("input_cached") is not None
-                        else item.get("input", 0) or 0
-                    ),
-                }
-
-    buckets: Dict[str, Dict[str, Tokens]] = collections.defaultdict(
-        lambda: collections.defaultdict(lambda: Tokens(0, 0, 0))
-    )
+                key = _get_bucket_key(dt, granularity)
 
-    # If showing price, we also want to track costs in the same structure
-    # but we'll use a float for the values.
-    costs: Dict[str, Dict[str, float]] = collections.defaultdict(
-        lambda: collections.defaultdict(float)
-    )
-    # We'll also need sub-costs for the stacked bar
-    sub_costs: Dict[str, Dict[str, Dict[str, float]]] = collections.defaultdict(
-        lambda: collections.defaultdict(lambda: {"input": 0.0, "output": 0.0, "cached": 0.0})
-    )
+            models = data.get("models", {})
+            if not isinstance(models, dict):
+                continue
 
-    for time_str, data in hourly.items():
-        if not isinstance(data, dict):
-            continue
-        try:
-            dt = datetime.fromisoformat(time_str)
-        except ValueError:
-            continue
+            kid = bucket_ids.get(key)
+            if kid is None:
+                kid = bucket_ids[key] = len(bucket_names)
+                bucket_names.append(key)
 
-        key = _get_bucket_key(dt, granularity)
-        models = data.get("models", {})
-        if not isinstance(models, dict):
-            continue
+            for model, usage in models.items():
+                if not isinstance(usage, dict):
+                    continue
+                if filter_search and not filter_search(model):
+                    continue
 
-        for model, usage in models.items():
-            if not isinstance(usage, dict):
+                mid = model_ids.get(model)
+                if mid is None:
+                    mid = model_ids[model] = len(model_names)
+                    model_names.append(model)
+
+                row_b.append(kid)
+                row_m.append(mid)
+                row_in.append(int(usage.get("input_tokens", 0)))
+                row_out.append(int(usage.get("output_tokens", 0)))
+                row_cached.append(int(usage.get("cached_tokens", 0)))
+
+        if len(row_b) > 1000:
+            n_models = len(model_names)
+            flat = (
+                np.asarray(row_b, dtype=np.int64) * n_models
+                + np.asarray(row_m, dtype=np.int64)
+            )
+            size = len(bucket_names) * n_models
+            sums_in = np.bincount(flat, weights=row_in, minlength=size)
+            sums_out = np.bincount(flat, weights=row_out, minlength=size)
+            sums_cached = np.bincount(flat, weights=row_cached, minlength=size)
+
+            for cell in np.unique(flat):
+                cell = int(cell)
+                key = bucket_names[cell // n_models]
+                model = model_names[cell % n_models]
+                buckets[(key, model)] = [
+                    int(sums_in[cell]),
+                    int(sums_out[cell]),
+                    int(sums_cached[cell]),
+                ]
+                bucket_set = key_models.get(key)
+                if bucket_set is None:
+                    bucket_set = key_models[key] = set()
+                bucket_set.add(model)
+        else:
+            # Too few rows for the array machinery to pay off.
+            for kid, mid, inp, out, cached in zip(
+                row_b, row_m, row_in, row_out, row_cached
+            ):
+                key = bucket_names[kid]
+                model = model_names[mid]
+                bk = (key, model)
+                row = buckets.get(bk)
+                if row is None:
+                    row = buckets[bk] = [0, 0, 0]
+                row[0] += inp
+                row[1] += out
+                row[2] += cached
+
+                bucket_set = key_models.get(key)
+                if bucket_set is None:
+                    bucket_set = key_models[key] = set()
+                bucket_set.add(model)
+    elif not used_rollup:
+        cutoff = cutoff_dt.isoformat() if cutoff_dt else ""
+        for time_str, data in _iter_table(path, "hourly"):
+            seen_any = True
+            if cutoff and time_str < cutoff:
                 continue
+            if not isinstance(data, dict):
+                continue
+
+            key = _bucket_key_from_iso(time_str, granularity)
+            if key is None:
+                try:
+                    dt = datetime.fromisoformat(time_str)
+                except ValueError:
+                    continue
+                key = _get_bucket_key(dt, granularity)
+
+            models = data.get("models", {})
+            if isinstance(models, dict):
+                add_bucket(key, models)
 
-            if filter_re and not filter_re.search(model):
+    # Costs are linear in token counts, so they can be derived from the
+    # aggregated sums — one price lookup per (bucket, model) cell rather
+    # than one per hourly record.
+    if show_price:
+        for (key, model), row in buckets.items():
+            p = find_price(model)
+            if p is None:
+                # Model not found in price map, remains 0
                 continue
 
-            t_inc = Tokens(
-                input=int(usage.get("input_tokens", 0)),
-                output=int(usage.get("output_tokens", 0)),
-                cached=int(usage.get("cached_tokens", 0)),
-            )
+            c_in = (row[0] - row[2]) * p[0]
+            c_cached = row[2] * p[1]
+            c_out = row[1] * p[2]
+            costs[(key, model)] = c_in + c_cached + c_out
+            sub_costs[(key, model)] = [c_in, c_out, c_cached]
 
-            current = buckets[key][model]
-            current.input += t_inc.input
-            current.output += t_inc.output
-            current.cached += t_inc.cached
+    if not buckets:
+        print("No data in range." if seen_any else "No usage recorded.")
+        return 0
 
-            if show_price:
-                p = _find_price(price_map, model)
-                if p:
-                    uncached = t_inc.input - t_inc.cached
-                    c_in = (uncached * p["input"]) / 1_000_000
-                    c_cached = (t_inc.cached * p["input_cached"]) / 1_000_000
-                    c_out = (t_inc.output * p["output"]) / 1_000_000
-                    
-                    costs[key][model] += (c_in + c_cached + c_out)
-                    sub_costs[key][model]["input"] += c_in
-                    sub_costs[key][model]["cached"] += c_cached
-                    sub_costs[key][model]["output"] += c_out
-                else:
-                    # Model not found in price map, remains 0.0
-                    pass
-
-    sorted_keys = sorted(buckets.keys())
+    sorted_keys = sorted(key_models.keys())
     if units > 0:
         sorted_keys = sorted_keys[-units:]
 
-    if not sorted_keys:
-        print("No data in range.")
-        return 0
+    # Per-bucket active models, sorted so segment order follows the
+    # global color assignment. Price renders only show priced models.
+    if show_price:
+        active_by_key = {
+            key: sorted(m for m in key_models[key] if (key, m) in costs)
+            for key in sorted_keys
+        }
+    else:
+        active_by_key = {key: sorted(key_models[key]) for key in sorted_keys}
 
-    # Calculate scaling
-    max_total = 0.0
+    # Calculate scaling. Totals stay integers (tokens, or picodollars
+    # when pricing) so the bar math below can use exact // divisions.
+    max_total = 0
+    totals: Dict[str, int] = {}
     all_models = set()
     for key in sorted_keys:
+        active = active_by_key[key]
+        all_models.update(active)
         if show_price:
-            models_cost = costs[key]
-            total = sum(models_cost.values())
-            all_models.update(models_cost.keys())
+            total = sum(costs[(key, m)] for m in active)
         else:
-            models_usage = buckets[key]
-            total = float(sum(t.total for t in models_usage.values()))
-            all_models.update(models_usage.keys())
-        
+            total = sum(
+                buckets[(key, m)][0] + buckets[(key, m)][1] for m in active
+            )
+
+        totals[key] = total
         if total > max_total:
             max_total = total
 
@@ -544,58 +1059,65 @@ def _print_graph(
 
     width = 40
     for key in sorted_keys:
-        bar_str = ""
-        if show_price:
-            models_cost = costs[key]
-            total = sum(models_cost.values())
-        else:
-            models_usage = buckets[key]
-            total = float(sum(t.total for t in models_usage.values()))
+        # Collect segments and join once at the end; += on a str would
+        # reallocate the whole bar for every segment.
+        parts: List[str] = []
+        total = totals[key]
 
-        if max_total > 0:
-            bar_len = int((total / max_total) * width)
-        else:
-            bar_len = 0
+        bar_len = (total * width) // max_total if max_total > 0 else 0
 
-        # Sort models to keep color order consistent in the bar
-        for m in sorted_models:
+        # Only models present in this bucket; their lexical order matches
+        # the global color order, so colors stay consistent across rows.
+        for m in active_by_key[key]:
+            bk = (key, m)
             if show_price:
-                val_cost = costs[key].get(m, 0.0)
+                val_cost = costs[bk]
                 if val_cost == 0:
                     continue
-                
-                # Calculate segment length for this model
-                model_seg_len = int((val_cost / total) * bar_len) if total > 0 else 0
-                if model_seg_len == 0:
+
+                # Calculate segment length for this model. Floor division
+                # rounds toward -inf, so degenerate records (for example
+                # cached_tokens exceeding input_tokens, making the cost
+                # negative) must be skipped here, not just zero ones.
+                model_seg_len = (val_cost * bar_len) // total if total > 0 else 0
+                if model_seg_len <= 0:
                     continue
-                
-                sc = sub_costs[key][m]
-                out_len = int((sc["output"] / val_cost) * model_seg_len)
-                cached_len = int((sc["cached"] / val_cost) * model_seg_len)
+
+                sc = sub_costs[bk]
+                out_len = (sc[1] * model_seg_len) // val_cost
+                cached_len = (sc[2] * model_seg_len) // val_cost
+                # Clamp the sub-splits so the segment never exceeds its
+                # allotted cells even when one share is out of range.
+                out_len = min(max(out_len, 0), model_seg_len)
+                cached_len = min(max(cached_len, 0), model_seg_len - out_len)
                 inp_len = model_seg_len - out_len - cached_len
             else:
-                val = buckets[key].get(m)
-                if not val or val.total == 0:
+                row = buckets[bk]
+                val_total = row[0] + row[1]
+                if val_total == 0:
                     continue
 
                 # Calculate segment length for this model
-                model_seg_len = int((val.total / total) * bar_len) if total > 0 else 0
-                if model_seg_len == 0:
+                model_seg_len = (val_total * bar_len) // total if total > 0 else 0
+                if model_seg_len <= 0:
                     continue
-                
+
                 # Now distribute model_seg_len into output, input, cached
-                out_len = int((val.output / val.total) * model_seg_len)
-                cached_len = int((val.cached / val.total) * model_seg_len)
+                out_len = (row[1] * model_seg_len) // val_total
+                cached_len = (row[2] * model_seg_len) // val_total
+                out_len = min(max(out_len, 0), model_seg_len)
+                cached_len = min(max(cached_len, 0), model_seg_len - out_len)
                 inp_len = model_seg_len - out_len - cached_len
-            
-            color = model_colors[m]
-            bar_str += f"{color}"
-            bar_str += "█" * out_len
-            bar_str += "▓" * inp_len
-            bar_str += "░" * cached_len
-            bar_str += f"{RESET}"
-
-        total_fmt = _fmt_money(total) if show_price else _fmt_int(int(total))
+
+            parts.append(model_colors[m])
+            parts.append(_segment(out_len, inp_len, cached_len))
+            parts.append(RESET)
+
+        bar_str = "".join(parts)
+        if show_price:
+            total_fmt = _fmt_money(total / 1_000_000_000_000)
+        else:
+            total_fmt = _fmt_int(total)
         print(f"{key:<16} │ {bar_str} {total_fmt}")
 
     print("─" * 78)
@@ -614,7 +1136,9 @@ def main(argv: List[str]) -> int:
         "--hook",
         action="store_true",
         help=(
-            "Record the current turn's token usage to $LECTIC_DATA/usage.json"
+            "Record the current turn's token usage to the usage log in "
+            "$LECTIC_DATA (folded into usage.json at the next render or "
+            "--compact)"
         ),
     )
     parser.add_argument(
@@ -649,6 +1173,21 @@ def main(argv: List[str]) -> int:
             "Download fresh pricing data from pydantic/genai-prices"
         ),
     )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help=(
+            "Fold pending records from the write-ahead log into usage.json"
+        ),
+    )
+    parser.add_argument(
+        "--rebuild-rollups",
+        action="store_true",
+        help=(
+            "Rebuild the daily/weekly/monthly roll-up tables from the "
+            "hourly data"
+        ),
+    )
 
     args = parser.parse_args(argv)
 
@@ -656,13 +1195,19 @@ def main(argv: List[str]) -> int:
         if args.refresh_prices:
             return _refresh_prices()
 
+        if args.rebuild_rollups:
+            return _rebuild_rollups()
+
+        if args.compact:
+            _compact_wal()
+            return 0
+
         if args.hook:
             return _record_hook_usage()
 
-        path = _usage_path()
-        db = _load_json(path)
+        _compact_wal()
         return _print_graph(
-            db,
+            _usage_path(),
             args.granularity,
             args.units,
             args.filter,